@@ -5,6 +5,7 @@ from dotenv import load_dotenv
 from app.utils import *
 from app.prompts import *
 from app.analyzer import *
+from app.messaging import send_message
 import google.generativeai as genai
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
@@ -18,13 +19,15 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
 
 class InterviewBot:
-    def __init__(self, cv_text, job_description, results):
+    def __init__(self, cv_text, job_description, results, on_result=None):
         self.stages = ["INTRODUCTION", "PROJECT", "CODING", "TECHNICAL", "OUTRO"]
         self.message_history = ChatMessageHistory()
         self.result = results
+        self.on_result = on_result
         self.answer_event = asyncio.Event()
         self.current_answer = None
         self.stop_interview = asyncio.Event()
+        self.stopped = asyncio.Event()
         self.coding_event = asyncio.Event()
 
         try:
@@ -77,15 +80,27 @@ class InterviewBot:
                 "Write a python code to Print Hello Anish",
                 "Write a python code to Print Hello Duniya"
             ])
-            await websocket.send_json({'type': 'coding_question', 'message': q1})
+            await send_message(websocket, {'type': 'coding_question', 'message': q1})
             await asyncio.wait_for(self.coding_event.wait(), timeout=300)  # 5-minute timeout
             self.coding_event.clear()
         except asyncio.TimeoutError:
-            await websocket.send_json({'type': 'coding_timeout', 'message': 'Coding question timed out'})
+            await send_message(websocket, {'type': 'coding_timeout', 'message': 'Coding question timed out'})
         except Exception as e:
-            await websocket.send_json({'type': 'coding_error', 'message': f'Error in coding stage: {str(e)}'})
+            await send_message(websocket, {'type': 'coding_error', 'message': f'Error in coding stage: {str(e)}'})
+
+    def stop(self):
+        # Wake any pending answer or coding wait so the stop is noticed immediately
+        self.stop_interview.set()
+        self.answer_event.set()
+        self.coding_event.set()
 
     async def conduct_interview(self, websocket):
+        try:
+            await self.run_stages(websocket)
+        finally:
+            self.stopped.set()
+
+    async def run_stages(self, websocket):
         for stage in self.stages:
             print(f"\n--- {stage} STAGE ---")
             try:
@@ -97,8 +112,12 @@ class InterviewBot:
                     )
                 elif stage == "CODING":
                     for i in range(2):
+                        if self.stop_interview.is_set():
+                            return
                         await self.start_coding_stage(websocket=websocket)
-                    await websocket.send_json({'type': 'coding_ended', 'message': "The End of Coding Round"})
+                    if self.stop_interview.is_set():
+                        return
+                    await send_message(websocket, {'type': 'coding_ended', 'message': "The End of Coding Round"})
                     continue
                 else:
                     try:
@@ -126,7 +145,7 @@ class InterviewBot:
                         break
 
                     print("Interviewer:", response)
-                    await websocket.send_json({'type': 'interview_question', 'question': response})
+                    await send_message(websocket, {'type': 'interview_question', 'question': response})
 
                     try:
                         await asyncio.wait_for(self.answer_event.wait(), timeout=300)  # 5-minute timeout
@@ -134,9 +153,12 @@ class InterviewBot:
                         self.current_answer = None
                         self.answer_event.clear()
                     except asyncio.TimeoutError:
-                        await websocket.send_json({'type': 'answer_timeout', 'message': 'Answer timed out'})
+                        await send_message(websocket, {'type': 'answer_timeout', 'message': 'Answer timed out'})
                         break
 
+                    if self.stop_interview.is_set():
+                        return
+
                     print("You:", answer)
                     if answer and "exit" in answer.lower():
                         return
@@ -147,12 +169,14 @@ class InterviewBot:
                         break
                     if stage != "CODING":
                         self.result[stage][response] = answer
+                        if self.on_result:
+                            self.on_result()
                     await asyncio.sleep(0.1)
 
             except Exception as e:
                 print(f"Error in {stage} stage: {str(e)}")
-                await websocket.send_json({'type': 'stage_error', 'message': f'Error in {stage} stage: {str(e)}'})
+                await send_message(websocket, {'type': 'stage_error', 'message': f'Error in {stage} stage: {str(e)}'})
                 continue
 
         print("\nInterview concluded. Thank you for your time!")
-        await websocket.send_json({'type': 'interview_end', 'message': 'Interview completed'})
+        await send_message(websocket, {'type': 'interview_end', 'message': 'Interview completed'})
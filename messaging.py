@@ -0,0 +1,7 @@
+import orjson
+
+async def send_message(websocket, payload):
+    """
+    Serializes a message with orjson and sends it as a binary websocket frame.
+    """
+    await websocket.send_bytes(orjson.dumps(payload))
@@ -2,28 +2,48 @@ import os
 import sys
 import logging
 import asyncio
+import copy
+import json
 import random
+import pybase64
+import hashlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from pydantic import BaseModel, ValidationError
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from dotenv import load_dotenv
 from app.interviewer import InterviewBot
 from app.analyzer import analyze_results, summary_results
 from app.utils import get_cv, get_job_description
 from app.prompts import evaluate_code
-from app.speech_to_text import transcribe_audio_with_overlap
+from app.messaging import send_message
+from app.speech_to_text import AUDIO_QUEUE_SIZE, feed_pcm_frames, stream_transcribe, warm_up
 
 # Load environment variables
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# Open the Speech-to-Text connection before the first request needs it
+@asynccontextmanager
+async def lifespan(app):
+    try:
+        # Bound the whole call too, so a hung network cannot hold up startup
+        await asyncio.wait_for(warm_up(timeout=5.0), timeout=10.0)
+    except Exception as e:
+        logger.warning("Speech-to-Text warm-up failed: %s", e)
+    yield
+
 # FastAPI app setup
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Logging configuration
 logging.basicConfig(
     level=logging.INFO,
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 )
+logger = logging.getLogger(__name__)
 
 # State management
 class InterviewState:
@@ -31,15 +51,57 @@ class InterviewState:
         self.cv_text = ""
         self.job_description = ""
         self.interview_bot = None
+        self.handle_interview = None
         self.results = {"INTRODUCTION": {}, "PROJECT": {}, "CODING": {}, "TECHNICAL": {}, "OUTRO": {}}
         self.stop_interview = asyncio.Event()
+        # Bumped on every results write; analyses are reused until it changes
+        self.version = 0
+        self.cached_analysis = None  # (version, result)
+        self.cached_summary = None  # (version, result)
+
+    def bump_version(self):
+        self.version += 1
+
+# Bounded LRU cache for LLM responses, keyed by a hash of the request content
+class ResponseCache:
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+    def get(self, key):
+        if key not in self._entries:
+            return None
+        self._entries.move_to_end(key)
+        return self._entries[key]
+
+    def put(self, key, value):
+        # None marks a failed call; storing it would only evict good entries
+        if value is None:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+evaluation_cache = ResponseCache()
+analysis_cache = ResponseCache()
+summary_cache = ResponseCache()
 
 # Pydantic model for event validation
 class EventData(BaseModel):
     type: str
     code: str = None
     ques: str = None
-    audio_data: str = None
+    cv: dict = Field(default=None, repr=False)
+    jd: dict = None
+    audio_data: str = Field(default=None, repr=False)  # Keep megabytes of base64 out of logs
+
+# Built once so each message skips model schema setup
+_EVENT_ADAPTER = TypeAdapter(EventData)
 
 # Root endpoint
 @app.get("/")
@@ -57,71 +119,75 @@ async def websocket_endpoint(websocket: WebSocket):
             try:
                 await state.interview_bot.conduct_interview(websocket)
             except asyncio.CancelledError:
-                logging.info("Interview task cancelled")
+                logger.info("Interview task cancelled")
             except Exception as e:
-                logging.error(f"Error during interview: {e}")
+                logger.error("Error during interview: %s", e)
             finally:
                 state.interview_bot = None
 
+    state.handle_interview = handle_interview
+
     try:
         while True:
             try:
                 data = await websocket.receive_json()
-                logging.info(f"Received data: {data}")
-                event = EventData(**data)  # Validate incoming data
-                await handle_event(event, websocket, state, handle_interview)
+                logger.info("Received data type=%s", data.get("type") if isinstance(data, dict) else "?")
+                event = _EVENT_ADAPTER.validate_python(data)  # Validate incoming data
+                await _HANDLERS.get(event.type, handle_unknown)(event, websocket, state)
             except ValidationError as e:
-                logging.error(f"Validation error: {e}")
-                await websocket.send_json({"type": "error", "message": str(e)})
+                logger.error("Validation error: %s", e)
+                await send_message(websocket, {"type": "error", "message": str(e)})
 
     except WebSocketDisconnect:
-        logging.info("WebSocket disconnected")
+        logger.info("WebSocket disconnected")
     except Exception as e:
-        logging.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
     finally:
         if state.interview_bot:
-            state.interview_bot.stop_interview.set()
+            state.interview_bot.stop()
             state.interview_bot = None
 
-# Event handler
-async def handle_event(event: EventData, websocket: WebSocket, state: InterviewState, handle_interview):
-    if event.type == 'upload_cv':
-        await handle_upload_cv(websocket, state)
-    elif event.type == 'analyze_jd':
-        await handle_analyze_jd(websocket, state)
-    elif event.type == 'start_interview':
-        await handle_start_interview(websocket, state, handle_interview)
-    elif event.type == 'answer':
-        await handle_answer(event, state)
-    elif event.type == 'coding':
-        await handle_coding(event, websocket, state)
-    elif event.type == 'end_interview':
-        await handle_end_interview(websocket, state)
-    elif event.type == 'get_analysis':
-        await handle_get_analysis(websocket, state)
-    elif event.type == 'get_summary_analysis':
-        await handle_summary_analysis(websocket, state)
-    elif event.type == 'test_coding_question':
-        await handle_test_coding_question(websocket)
-    elif event.type == 'audio':
-        await handle_audio_transcription(event, websocket, state)
-
 # Event-specific handlers
-async def handle_upload_cv(websocket, state):
+async def handle_upload_cv(event, websocket, state):
     state.cv_text = await get_cv(await websocket.receive_json(), websocket)
-    await websocket.send_json({'type': 'cv_uploaded', 'message': 'CV data received', 'cv_text': state.cv_text})
+    await send_message(websocket, {'type': 'cv_uploaded', 'message': 'CV data received', 'cv_text': state.cv_text})
 
-async def handle_analyze_jd(websocket, state):
+async def handle_analyze_jd(event, websocket, state):
     state.job_description = await get_job_description(await websocket.receive_json(), websocket)
-    await websocket.send_json({'type': 'jd_analyzed', 'message': 'Received JD Successfully', 'job_description': state.job_description})
+    await send_message(websocket, {'type': 'jd_analyzed', 'message': 'Received JD Successfully', 'job_description': state.job_description})
 
-async def handle_start_interview(websocket, state, handle_interview):
+async def handle_prepare(event, websocket, state):
+    if not event.cv or not event.jd:
+        await send_message(websocket, {"type": "error", "message": "Both CV and JD data are required"})
+        return
+
+    try:
+        # Parse CV and JD concurrently; the task group cancels one if the other fails
+        async with asyncio.TaskGroup() as tg:
+            cv_task = tg.create_task(get_cv(event.cv, websocket))
+            jd_task = tg.create_task(get_job_description(event.jd, websocket))
+    except Exception as e:
+        error = e.exceptions[0] if isinstance(e, ExceptionGroup) else e
+        logger.error("Error preparing interview: %s", error)
+        await send_message(websocket, {"type": "error", "message": str(error)})
+        return
+
+    state.cv_text, state.job_description = cv_task.result(), jd_task.result()
+
+    await send_message(websocket, {
+        'type': 'interview_prepared',
+        'message': 'CV and JD received',
+        'cv_text': state.cv_text,
+        'job_description': state.job_description
+    })
+
+async def handle_start_interview(event, websocket, state):
     if not state.interview_bot:
-        state.interview_bot = InterviewBot(state.cv_text, state.job_description, state.results)
-        asyncio.create_task(handle_interview())
-        await websocket.send_json({"type": "interview_started", "message": "Interview started"})
+        state.interview_bot = InterviewBot(state.cv_text, state.job_description, state.results, on_result=state.bump_version)
+        asyncio.create_task(state.handle_interview())
+        await send_message(websocket, {"type": "interview_started", "message": "Interview started"})
 
-async def handle_answer(event, state):
+async def handle_answer(event, websocket, state):
     if state.interview_bot:
         state.interview_bot.current_answer = event.code  # Assuming answer is passed in `code`
         state.interview_bot.answer_event.set()
@@ -129,63 +195,135 @@ async def handle_answer(event, state):
 async def handle_coding(event, websocket, state):
     try:
         if state.interview_bot:
-            response = evaluate_code(state.interview_bot.llm, event.ques, event.code)
-            await websocket.send_json({"type": "code_evaluation", "result": response})
+            key = ResponseCache.key(event.ques, event.code)
+            response = evaluation_cache.get(key)
+            if response is None:
+                response = await asyncio.to_thread(evaluate_code, state.interview_bot.model, event.ques, event.code)
+                evaluation_cache.put(key, response)
+            await send_message(websocket, {"type": "code_evaluation", "result": response})
             if response and response.get("RESULT"):
                 state.interview_bot.coding_event.set()
     except Exception as e:
-        logging.error(f"Error in coding handler: {e}")
-        await websocket.send_json({"type": "coding_error", "message": str(e)})
+        logger.error("Error in coding handler: %s", e)
+        await send_message(websocket, {"type": "coding_error", "message": str(e)})
 
-async def handle_end_interview(websocket, state):
-    if state.interview_bot:
-        state.interview_bot.stop_interview.set()
-        await asyncio.sleep(0.1)
-        state.interview_bot.stop_interview.clear()
-        await websocket.send_json({"type": "interview_end", "message": "Interview ended"})
-    logging.info("Interview concluded")
+async def handle_end_interview(event, websocket, state):
+    bot = state.interview_bot
+    if bot:
+        bot.stop()
+        try:
+            await asyncio.wait_for(bot.stopped.wait(), timeout=2.0)
+        except asyncio.TimeoutError:
+            logger.warning("Interview did not stop within 2 seconds")
+        await send_message(websocket, {"type": "interview_end", "message": "Interview ended"})
+    logger.info("Interview concluded")
+
+# Runs an LLM analysis over the interview results, reusing the result stored on
+# `state.<attr>` until the results version changes
+async def _cached_llm_result(state, attr, cache, fn):
+    version = state.version
+    cached = getattr(state, attr)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    # Key and LLM input come from one snapshot so they always describe the same content
+    results = copy.deepcopy(state.results)
+    key = ResponseCache.key(results)
+    result = cache.get(key)
+    if result is None:
+        result = await asyncio.to_thread(fn, results)
+        cache.put(key, result)
+    # A failed call should be retried on the next poll, not replayed
+    if result is not None:
+        setattr(state, attr, (version, result))
+    return result
 
-async def handle_get_analysis(websocket, state):
-    result = analyze_results(state.results)
-    await websocket.send_json({"type": "analysis", "result": result})
+async def handle_get_analysis(event, websocket, state):
+    result = await _cached_llm_result(state, "cached_analysis", analysis_cache, analyze_results)
+    await send_message(websocket, {"type": "analysis", "result": result})
 
-async def handle_summary_analysis(websocket, state):
-    summary = summary_results(state.results)
-    await websocket.send_json({"type": "summary_analysis", "result": summary})
+async def handle_summary_analysis(event, websocket, state):
+    summary = await _cached_llm_result(state, "cached_summary", summary_cache, summary_results)
+    await send_message(websocket, {"type": "summary_analysis", "result": summary})
 
-async def handle_test_coding_question(websocket):
+async def handle_test_coding_question(event, websocket, state):
     question = random.choice([
         "Q1. Print Hello World",
         "Q2. Print Hello Anish",
         "Q3. Print Hello Duniya"
     ])
-    await websocket.send_json({"type": "test_coding_question", "message": question})
+    await send_message(websocket, {"type": "test_coding_question", "message": question})
 
 async def handle_audio_transcription(event, websocket, state):
     try:
         if not event.audio_data:
-            await websocket.send_json({"type": "error", "message": "No audio data provided"})
+            await send_message(websocket, {"type": "error", "message": "No audio data provided"})
             return
 
-        # Transcribe audio using overlapping chunks
-        transcription = transcribe_audio_with_overlap(event.audio_data)
-        await websocket.send_json({"type": "transcription_complete", "transcription": transcription})
+        # Decoder and recognizer run concurrently; the bounded queue applies backpressure
+        audio_queue = asyncio.Queue(maxsize=AUDIO_QUEUE_SIZE)
+        decoder = asyncio.create_task(feed_pcm_frames(pybase64.b64decode(event.audio_data, validate=False), audio_queue))
+        try:
+            # Forward the running transcription after every result, interim or final
+            final_parts = []
+            async for transcript, is_final in stream_transcribe(audio_queue):
+                if is_final:
+                    final_parts.append(transcript.strip())
+                    partial = " ".join(final_parts)
+                else:
+                    partial = " ".join(final_parts + [transcript.strip()])
+                await send_message(websocket, {"type": "transcription_partial", "transcription": partial})
+            await decoder
+        finally:
+            # Always collect the decoder so a failure there is never left unretrieved
+            decoder.cancel()
+            await asyncio.gather(decoder, return_exceptions=True)
+
+        transcription = " ".join(final_parts).strip()
+        await send_message(websocket, {"type": "transcription_complete", "transcription": transcription})
 
         # Add transcription to the current answer
         if transcription and state.interview_bot:
             state.interview_bot.current_answer = transcription
             state.interview_bot.answer_event.set()
     except Exception as e:
-        logging.error(f"Error during audio transcription: {e}")
-        await websocket.send_json({"type": "transcription_error", "message": str(e)})
+        logger.error("Error during audio transcription: %s", e)
+        await send_message(websocket, {"type": "transcription_error", "message": str(e)})
+
+async def handle_unknown(event, websocket, state):
+    logger.warning("Ignoring unknown event type=%s", event.type)
+
+# Event type -> handler dispatch table
+_HANDLERS: dict[str, Callable[[EventData, WebSocket, InterviewState], Awaitable[None]]] = {
+    'upload_cv': handle_upload_cv,
+    'analyze_jd': handle_analyze_jd,
+    'prepare': handle_prepare,
+    'start_interview': handle_start_interview,
+    'answer': handle_answer,
+    'coding': handle_coding,
+    'end_interview': handle_end_interview,
+    'get_analysis': handle_get_analysis,
+    'get_summary_analysis': handle_summary_analysis,
+    'test_coding_question': handle_test_coding_question,
+    'audio': handle_audio_transcription,
+}
 
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request, exc):
-    logging.error(f"Unhandled exception: {exc}")
-    return JSONResponse(content={"error": "Internal server error"}, status_code=500)
+    logger.error("Unhandled exception: %s", exc)
+    return ORJSONResponse(content={"error": "Internal server error"}, status_code=500)
 
 # Entry point
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Workers need an import string; each one keeps its own response caches
+    uvicorn.run(
+        "app.server:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=os.cpu_count(),
+        loop="uvloop",
+        http="httptools",
+        ws="websockets"
+    )
@@ -1,114 +1,126 @@
-import os
-import subprocess
+import io
+import av
+import asyncio
 from google.cloud import speech
+from google.cloud.speech_v1 import SpeechAsyncClient
+from google.cloud.speech_v1.services.speech.transports import SpeechGrpcAsyncIOTransport
 from google.oauth2 import service_account
 
 # Load Google Cloud credentials
 client_file = "resp.json"
 creds = service_account.Credentials.from_service_account_file(client_file)
-speech_client = speech.SpeechClient(credentials = creds)
 
-def merge_chunks(chunks, output_path):
+# Keepalive pings during calls keep long streams alive through idle-dropping
+# middleboxes and surface dead connections quickly instead of on the next request
+channel = SpeechGrpcAsyncIOTransport.create_channel(
+    credentials=creds,
+    options=[
+        # Carried over from the generated transport's defaults
+        ("grpc.max_send_message_length", -1),
+        ("grpc.max_receive_message_length", -1),
+        ("grpc.keepalive_time_ms", 30000),
+        ("grpc.keepalive_timeout_ms", 10000),
+        ("grpc.http2.max_pings_without_data", 0),
+    ]
+)
+speech_client = SpeechAsyncClient(transport=SpeechGrpcAsyncIOTransport(channel=channel))
+
+FRAME_BYTES = int(0.1 * 16000 * 2)  # 100 ms of 16kHz 16-bit mono audio
+AUDIO_QUEUE_SIZE = 32  # frames buffered between decoder and recognizer (~3 s)
+
+# Recognition configs are identical for every request, so build them once
+_RECOGNITION_CONFIG = speech.RecognitionConfig(
+    encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+    sample_rate_hertz=16000,
+    language_code="en-US"
+)
+_STREAMING_CONFIG = speech.StreamingRecognitionConfig(
+    config=_RECOGNITION_CONFIG,
+    interim_results=True,
+    single_utterance=False
+)
+
+def _decode_pcm(audio_bytes):
     """
-    Merges multiple audio chunks into a single file.
+    Decodes an uploaded audio blob in-process and yields 16kHz mono LINEAR16 PCM
+    as the decoder produces it.
     """
-    with open(output_path, "wb") as f:
-        for chunk in chunks:
-            f.write(chunk)
-
-def convert_to_wav(input_path, output_path):
+    resampler = av.AudioResampler(format="s16", layout="mono", rate=16000)
+    with av.open(io.BytesIO(audio_bytes)) as container:
+        for frame in container.decode(audio=0):
+            for resampled in resampler.resample(frame):
+                yield resampled.to_ndarray().tobytes()
+    # Flush samples still buffered in the resampler
+    for resampled in resampler.resample(None):
+        yield resampled.to_ndarray().tobytes()
+
+def iter_pcm_frames(audio_bytes):
     """
-    Converts a given audio file to WAV format with 16kHz sample rate and mono channel.
+    Yields the decoded PCM of an uploaded audio blob in FRAME_BYTES sized frames.
     """
     try:
-        subprocess.run(
-            ["ffmpeg", "-i", input_path, "-ar", "16000", "-ac", "1", "-f", "wav", output_path],
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-    except subprocess.CalledProcessError as e:
-        raise RuntimeError(f"Failed to convert audio to WAV: {e.stderr.decode()}")
-
-def merge_with_overlap(previous, current):
+        buffer = bytearray()
+        for pcm in _decode_pcm(audio_bytes):
+            buffer += pcm
+            # Slice through a memoryview so each frame is copied once, then
+            # compact the buffer once instead of shifting it after every frame
+            start = 0
+            with memoryview(buffer) as view:
+                while len(buffer) - start >= FRAME_BYTES:
+                    yield bytes(view[start:start + FRAME_BYTES])
+                    start += FRAME_BYTES
+            del buffer[:start]
+        if buffer:
+            yield bytes(buffer)
+    except av.error.FFmpegError as e:
+        raise RuntimeError(f"Failed to decode audio: {e}")
+
+async def feed_pcm_frames(audio_bytes, audio_queue):
     """
-    Merges two overlapping transcriptions by checking letter-by-letter overlaps.
-    Handles exact matches and partial word overlaps.
+    Decodes an uploaded audio blob onto `audio_queue`, ending with a `None` frame.
+    Decoding pauses while the queue is full, so a bounded queue bounds memory.
     """
-    previous_words = previous.split()
-    current_words = current.split()
-
-    if not previous_words or not current_words:
-        return previous + " " + current
-
-    # Last word of previous chunk and first word of current chunk
-    last_word_prev = previous_words[-1]
-    first_word_curr = current_words[0]
-
-    # Check for exact match
-    if last_word_prev == first_word_curr:
-        return previous + " " + " ".join(current_words[1:])
-
-    # Check for partial match
-    overlap_index = -1
-    for i in range(len(last_word_prev)):
-        if first_word_curr.startswith(last_word_prev[i:]):
-            overlap_index = i
-            break
-
-    if overlap_index != -1:
-        # Merge partial match
-        merged_word = last_word_prev[:overlap_index] + first_word_curr
-        return " ".join(previous_words[:-1] + [merged_word] + current_words[1:])
-
-    # No match, just concatenate
-    return previous + " " + current
+    frames = iter_pcm_frames(audio_bytes)
+    try:
+        while True:
+            # Decoding is CPU-bound, so each step runs off the event loop
+            frame = await asyncio.to_thread(next, frames, None)
+            if frame is None:
+                break
+            await audio_queue.put(frame)
+    except Exception:
+        await audio_queue.put(None)
+        raise
+    await audio_queue.put(None)
+
+async def warm_up(timeout=5.0):
+    """
+    Sends a 1 ms recognize request so the channel is connected before the first interview.
+    """
+    audio = speech.RecognitionAudio(content=bytes(int(0.001 * 16000 * 2)))
+    await speech_client.recognize(config=_RECOGNITION_CONFIG, audio=audio, timeout=timeout)
 
-def transcribe_audio_with_overlap(wav_path):
+async def stream_transcribe(audio_queue):
     """
-    Transcribes a WAV file in overlapping chunks using Google Speech-to-Text API.
-    Handles incomplete words across chunk boundaries.
+    Streams PCM frames from `audio_queue` to Google Speech-to-Text and yields
+    (transcript, is_final) pairs as soon as the API returns them.
+    A `None` frame on the queue ends the stream.
     """
-    transcription = ""
-    overlap_duration = int(0.5 * 16000 * 2)  # 0.5 second overlap
-    chunk_duration = int(5 * 16000 * 2)  # 5 seconds
+    async def request_iter():
+        # The first request carries the config, the rest carry audio
+        yield speech.StreamingRecognizeRequest(streaming_config=_STREAMING_CONFIG)
+        while True:
+            frame = await audio_queue.get()
+            if frame is None:
+                return
+            yield speech.StreamingRecognizeRequest(audio_content=frame)
 
     try:
-        with open(wav_path, "rb") as audio_file:
-            audio_content = audio_file.read()
-
-        previous_transcription = ""
-        start = 0
-
-        while start < len(audio_content):
-            # Define the end of the chunk with overlap
-            end = min(start + chunk_duration + overlap_duration, len(audio_content))
-            chunk = audio_content[start:end]
-
-            # Configure Google Speech-to-Text API
-            audio = speech.RecognitionAudio(content=chunk)
-            config = speech.RecognitionConfig(
-                encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
-                sample_rate_hertz=16000,
-                language_code="en-US"
-            )
-
-            # Perform transcription
-            response = speech_client.recognize(config=config, audio=audio)
-
-            chunk_transcription = " ".join(
-                [result.alternatives[0].transcript for result in response.results]
-            )
-
-            # Merge transcriptions across overlapping chunks
-            if previous_transcription:
-                transcription += merge_with_overlap(previous_transcription, chunk_transcription)
-            else:
-                transcription += chunk_transcription
-
-            start += chunk_duration
-            previous_transcription = chunk_transcription
-
-        return transcription.strip()
+        responses = await speech_client.streaming_recognize(requests=request_iter())
+        async for response in responses:
+            if not response.results or not response.results[0].alternatives:
+                continue
+            result = response.results[0]
+            yield result.alternatives[0].transcript, result.is_final
     except Exception as e:
         raise RuntimeError(f"Error during audio transcription: {e}")